@@ -1,54 +1,26 @@
 # Configuration file for the Sphinx documentation builder.
 
-import os
 import sys
 from pathlib import Path
-from typing import Optional, Type, TypeVar
 
-import tomlkit  # type: ignore[import]
-
-sys.path.insert(0, os.path.abspath("../../sengledwifipy"))
+import tomllib
 
 # This assumes that we have the full project root above, containing pyproject.toml
 _root = Path(__file__).parent.parent.parent.absolute()
-_toml = tomlkit.loads((_root / "pyproject.toml").read_text(encoding="utf8"))
-
-T = TypeVar("T")
-
-
-def find(key: str, default: Optional[T] = None, as_type: type[T] = str) -> Optional[T]:
-    """Gets a value from pyproject.toml, or a default.
-
-    Original source: https://github.com/dmyersturnbull/tyrannosaurus
-    Copyright 2020–2021 Douglas Myers-Turnbull
-    SPDX-License-Identifier: Apache-2.0
-
-    Args:
-        key: A period-delimited TOML key; e.g. ``tools.poetry.name``
-        default: Default value if any node in the key is not found
-        as_type: Convert non-``None`` values to this type before returning
-
-    Returns:
-        The value converted to ``as_type``, or ``default`` if it was not found
-    """
-    at = _toml
-    for k in key.split("."):
-        at = at.get(k)
-        if at is None:
-            return default
-    return as_type(at)
-
+_poetry = tomllib.loads((_root / "pyproject.toml").read_text(encoding="utf8"))["tool"]["poetry"]
 
 # -- Project information -----------------------------------------------------
 
 language = "en"
-project = find("tool.poetry.name")
-version = find("tool.poetry.version")
+project = _poetry["name"]
+version = _poetry["version"]
 release = version
 copyright = f"{project} v{release}"
 
 # -- General configuration ---------------------------------------------------
 
+# autodoc imports the package from the project root
+sys.path.insert(0, str(_root))
 extensions = ["sphinx.ext.autodoc", "sphinx.ext.napoleon", "myst_parser"]
 
 # -- Options for HTML output -------------------------------------------------
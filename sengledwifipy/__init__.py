@@ -1,5 +1,37 @@
 """Python Package for controlling Sengled Wifi devices. SPDX-License-Identifier: Apache-2.0."""
 
-from .sengledwifiapi import SengledWifiAPI
-from .sengledwifilogin import SengledLogin
-from .sengledwifimqtt import SengledWifiMQTT
+from __future__ import annotations
+
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .sengledwifiapi import SengledWifiAPI
+    from .sengledwifilogin import SengledLogin
+    from .sengledwifimqtt import SengledWifiMQTT
+
+__version__ = "0.0.9"
+"""Package version, updated by semantic-release together with pyproject.toml."""
+
+__all__ = ["SengledLogin", "SengledWifiAPI", "SengledWifiMQTT"]
+
+_LAZY_IMPORTS = {
+    "SengledWifiAPI": ".sengledwifiapi",
+    "SengledLogin": ".sengledwifilogin",
+    "SengledWifiMQTT": ".sengledwifimqtt",
+}
+"""Public classes and the submodule defining them, imported on first access to avoid loading aiohttp and paho-mqtt."""
+
+
+def __getattr__(name: str) -> Any:
+    """Import the public classes on first access (PEP 562)."""
+    if name in _LAZY_IMPORTS:
+        value = getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    """Include the lazily imported classes."""
+    return sorted({*globals(), *_LAZY_IMPORTS})
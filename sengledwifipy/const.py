@@ -1,5 +1,7 @@
 """Python Package for controlling Sengled Wifi devices. SPDX-License-Identifier: Apache-2.0."""
 
+from types import MappingProxyType
+
 HA_DOMAIN = "sengledwifi"
 """For Home Assistant integration."""
 
@@ -12,9 +14,26 @@ EXCEPTION_TEMPLATE = "An exception of type {0} occurred. Arguments:\n{1!r}"
 USER_AGENT = "okhttp/4.9.2"
 """Needed for Login."""
 
-SENGLED_ENDPOINTS = {
-    "login": "https://ucenter.cloud.sengled.com/user/app/customer/v3/AuthenCross.json",
-    "validSession": "https://ucenter.cloud.sengled.com/user/app/customer/v2/isSessionTimeout.json",
-    "serverDetails": "https://life2.cloud.sengled.com/life2/server/getServerInfo.json",
-}
-"""Needed for Login."""
+VALID_LOGIN_CACHE_SECONDS = 30
+"""Seconds a successful session validation is reused before calling the validSession endpoint again."""
+
+DEVICES_CACHE_SECONDS = 5
+"""Seconds the device list of an account is reused by SengledWifiAPI.get_devices before requesting it again."""
+
+LOGIN_URL = "https://ucenter.cloud.sengled.com/user/app/customer/v3/AuthenCross.json"
+"""Authentication endpoint."""
+
+VALID_SESSION_URL = "https://ucenter.cloud.sengled.com/user/app/customer/v2/isSessionTimeout.json"
+"""Session validation endpoint."""
+
+SERVER_DETAILS_URL = "https://life2.cloud.sengled.com/life2/server/getServerInfo.json"
+"""Endpoint providing the appserver and MQTT addresses."""
+
+SENGLED_ENDPOINTS = MappingProxyType(
+    {
+        "login": LOGIN_URL,
+        "validSession": VALID_SESSION_URL,
+        "serverDetails": SERVER_DETAILS_URL,
+    }
+)
+"""Needed for Login. Read-only; SengledLogin keeps its own copy extended with the server endpoints."""
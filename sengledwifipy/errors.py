@@ -4,18 +4,28 @@
 class SengledWifipyError(Exception):
     """Define a base error."""
 
+    __slots__ = ()
+
 
 class SengledWifipyConnectionError(SengledWifipyError):
     """Define an error related to invalid requests."""
 
+    __slots__ = ()
+
 
 class SengledWifipyLoginError(SengledWifipyError):
     """Define an error related to no longer being logged in."""
 
+    __slots__ = ()
+
 
 class SengledWifipyTooManyRequestsError(SengledWifipyError):
     """Define an error related to too many requests."""
 
+    __slots__ = ()
+
 
 class SengledWifipyLoginCloseRequested(SengledWifipyError):
     """Define an error related to requesting access to API after requested close."""
+
+    __slots__ = ()
@@ -6,6 +6,7 @@ from asyncio import CancelledError
 from http.cookies import CookieError, Morsel
 from json import JSONDecodeError
 from types import MappingProxyType
+from typing import Any
 
 from aiohttp import ClientConnectionError, ContentTypeError, ServerDisconnectedError
 
@@ -19,12 +20,72 @@ from .errors import (
 
 _LOGGER = logging.getLogger(__name__)
 
+try:
+    from orjson import dumps as json_dumps
+    from orjson import loads as json_loads
+except ImportError:
+    from json import dumps as _json_dumps
+    from json import loads as json_loads
+
+    def json_dumps(obj: Any) -> bytes:
+        """Serialize obj to UTF-8 encoded JSON bytes, like orjson.dumps."""
+        return _json_dumps(obj).encode()
+
+
+_SENSITIVE_KEYS: frozenset[str] = frozenset(
+    {
+        "deviceSerialNumber",
+        "serialNumber",
+        "destinationUserId",
+        "customerId",
+        "access_token",
+        "refresh_token",
+    }
+)
+"""Keys whose values are always obfuscated, in addition to any key containing 'secret'."""
+
+_DICT_LIKE = (MappingProxyType, dict)
+_SEQUENCE_LIKE = (list, tuple)
+_CONTAINERS = (dict, list, tuple)
+_SERIAL_CONTAINERS = (dict, list)
+
+_format_exception = EXCEPTION_TEMPLATE.format
+
+_WARNING_TEMPLATE = "SengledWifi %s.%s(%s, %s): %s: %s"
+_CONNECTION_ERROR_MESSAGE = "A connection error occurred"
+_API_ERROR_MESSAGE = "A error occurred while calling an api"
+_TIMEOUT_ERROR_MESSAGE = "Timeout error occurred accessing SengledWifiAPI"
+_UNEXPECTED_ERROR_MESSAGE = "An error occurred accessing SengledWifiAPI"
+
+_EXCEPTION_ACTIONS: dict[type[BaseException], tuple[str | None, type[Exception] | None]] = {
+    ClientConnectionError: (_CONNECTION_ERROR_MESSAGE, SengledWifipyConnectionError),
+    KeyError: (_CONNECTION_ERROR_MESSAGE, SengledWifipyConnectionError),
+    ServerDisconnectedError: (_CONNECTION_ERROR_MESSAGE, SengledWifipyConnectionError),
+    JSONDecodeError: (_API_ERROR_MESSAGE, SengledWifipyLoginError),
+    CookieError: (_API_ERROR_MESSAGE, SengledWifipyLoginError),
+    ContentTypeError: (_API_ERROR_MESSAGE, SengledWifipyLoginError),
+    CancelledError: (_TIMEOUT_ERROR_MESSAGE, None),
+    SengledWifipyLoginCloseRequested: (None, None),
+    Exception: (_UNEXPECTED_ERROR_MESSAGE, None),
+}
+"""How catch_all_exceptions handles an exception class: the warning to log (None to skip it) and the error to raise instead.
+
+The most specific class in the exception's MRO wins. CancelledError is logged and swallowed, anything else without a
+replacement is re-raised, and classes missing from the table (e.g. KeyboardInterrupt) propagate untouched.
+"""
+
+
+@functools.lru_cache(maxsize=64)
+def _stars(count: int) -> str:
+    """Masking string of count asterisks, shared between calls of the same length."""
+    return "*" * count
+
 
 def hide_email(email: str) -> str:
     """Obfuscate email."""
     part = email.split("@")
     if len(part) > 1:
-        return f"{part[0][0]}{'*' * (len(part[0]) - 2)}{part[0][-1]}@{part[1][0]}{'*' * (len(part[1]) - 2)}{part[1][-1]}"
+        return f"{part[0][0]}{_stars(len(part[0]) - 2)}{part[0][-1]}@{part[1][0]}{_stars(len(part[1]) - 2)}{part[1][-1]}"
     return hide_serial(email)
 
 
@@ -35,77 +96,57 @@ def hide_password(value: str) -> str:
 
 def hide_serial(item: dict | str | list) -> dict | str | list:
     """Obfuscate serial."""
-    if item is None:
-        return ""
+    if not item:
+        return "" if item is None else item
     if isinstance(item, dict):
-        response = item.copy()
-        for key, value in item.items():
-            if (
-                isinstance(value, (dict, list))
-                or key
-                in [
-                    "deviceSerialNumber",
-                    "serialNumber",
-                    "destinationUserId",
-                    "customerId",
-                    "access_token",
-                    "refresh_token",
-                ]
-                or "secret" in key
-            ):
-                response[key] = hide_serial(value)
+        response = {
+            key: (
+                hide_serial(value)
+                if isinstance(value, _SERIAL_CONTAINERS) or key in _SENSITIVE_KEYS or "secret" in key
+                else value
+            )
+            for key, value in item.items()
+        }
     elif isinstance(item, str):
-        response = f"{item[0]}{'*' * (len(item) - 4)}{item[-3:]}" if len(item) > 6 else f"{'*' * len(item)}"
+        response = f"{item[0]}{_stars(len(item) - 4)}{item[-3:]}" if len(item) > 6 else _stars(len(item))
 
     elif isinstance(item, list):
-        response = []
-        for list_item in item:
-            if isinstance(list_item, dict):
-                response.append(hide_serial(list_item))
-            else:
-                response.append(list_item)
+        response = [hide_serial(list_item) if isinstance(list_item, dict) else list_item for list_item in item]
     return response
 
 
+_KEY_HANDLERS = {
+    "password": hide_password,
+    "email": hide_email,
+    "cookies_txt": lambda _: "OBFUSCATED COOKIE",
+}
+"""Keys obfuscated by obfuscate with a dedicated handler."""
+
+
+def _obfuscate_value(key: str, value):
+    """Obfuscate a single dict value according to its key."""
+    handler = _KEY_HANDLERS.get(key)
+    if handler is not None:
+        return handler(value)
+    if key in _SENSITIVE_KEYS or "secret" in key:
+        return hide_serial(value)
+    if isinstance(value, _CONTAINERS):
+        return obfuscate(value)
+    return value
+
+
 def obfuscate(item):
     """Obfuscate email, password, and other known sensitive keys."""
-    if item is None:
-        return ""
+    if not item:
+        return "" if item is None else item
     if isinstance(item, (Morsel)):
         response = dict({item.key: item.value})
         response[item.key] = "OBFUSCATEDCOOKIE"
         return response
-    if isinstance(item, (MappingProxyType, dict)):
-        response = item.copy()
-        for key, value in item.items():
-            if key in ["password"]:
-                response[key] = hide_password(value)
-            elif key in ["email"]:
-                response[key] = hide_email(value)
-            elif key in ["cookies_txt"]:
-                response[key] = "OBFUSCATED COOKIE"
-            elif (
-                key
-                in [
-                    "deviceSerialNumber",
-                    "serialNumber",
-                    "destinationUserId",
-                    "customerId",
-                    "access_token",
-                    "refresh_token",
-                ]
-                or "secret" in key
-            ):
-                response[key] = hide_serial(value)
-            elif isinstance(value, (dict, list, tuple)):
-                response[key] = obfuscate(value)
-    elif isinstance(item, (list, tuple)):
-        response = []
-        for list_item in item:
-            if isinstance(list_item, (dict, list, tuple)):
-                response.append(obfuscate(list_item))
-            else:
-                response.append(list_item)
+    if isinstance(item, _DICT_LIKE):
+        response = {key: _obfuscate_value(key, value) for key, value in item.items()}
+    elif isinstance(item, _SEQUENCE_LIKE):
+        response = [obfuscate(list_item) if isinstance(list_item, _CONTAINERS) else list_item for list_item in item]
         if isinstance(item, tuple):
             response = tuple(response)
     else:
@@ -115,52 +156,39 @@ def obfuscate(item):
 
 
 def catch_all_exceptions(func):  # noqa: D103
-    @functools.wraps(func)
-    async def wrapper(*args, **kwargs):
-        try:
-            return await func(*args, **kwargs)
-        except (ClientConnectionError, KeyError, ServerDisconnectedError) as ex:
-            _LOGGER.warning(
-                "SengledWifi %s.%s(%s, %s): A connection error occurred: %s",
-                func.__module__[func.__module__.find(".") + 1 :],
-                func.__name__,
-                obfuscate(args),
-                obfuscate(kwargs),
-                EXCEPTION_TEMPLATE.format(type(ex).__name__, ex.args),
-            )
-            raise SengledWifipyConnectionError from ex
-        except (JSONDecodeError, CookieError, ContentTypeError) as ex:
-            _LOGGER.warning(
-                "SengledWifi %s.%s(%s, %s): A error occurred while calling an api: %s",
-                func.__module__[func.__module__.find(".") + 1 :],
-                func.__name__,
-                obfuscate(args),
-                obfuscate(kwargs),
-                EXCEPTION_TEMPLATE.format(type(ex).__name__, ex.args),
-            )
-            raise SengledWifipyLoginError from ex
-        except CancelledError as ex:
-            _LOGGER.warning(
-                "SengledWifi %s.%s(%s, %s): Timeout error occurred accessing SengledWifiAPI: %s",
-                func.__module__[func.__module__.find(".") + 1 :],
-                func.__name__,
-                obfuscate(args),
-                obfuscate(kwargs),
-                EXCEPTION_TEMPLATE.format(type(ex).__name__, ex.args),
-            )
-            return None
-        except SengledWifipyLoginCloseRequested:
-            raise
-        except Exception as ex:
+    module = func.__module__[func.__module__.find(".") + 1 :]
+    name = func.__name__
+
+    def log_warning(message: str, ex: BaseException, args: tuple, kwargs: dict) -> None:
+        if _LOGGER.isEnabledFor(logging.WARNING):
             _LOGGER.warning(
-                "SengledWifi %s.%s(%s, %s): An error occurred accessing SengledWifiAPI: %s",
-                func.__module__[func.__module__.find(".") + 1 :],
-                func.__name__,
+                _WARNING_TEMPLATE,
+                module,
+                name,
                 obfuscate(args),
                 obfuscate(kwargs),
-                EXCEPTION_TEMPLATE.format(type(ex).__name__, ex.args),
+                message,
+                _format_exception(type(ex).__name__, ex.args),
             )
-            raise
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        except BaseException as ex:
+            for cls in type(ex).__mro__:
+                if cls in _EXCEPTION_ACTIONS:
+                    message, replacement = _EXCEPTION_ACTIONS[cls]
+                    break
+            else:
+                raise
+            if message is not None:
+                log_warning(message, ex, args, kwargs)
+            if cls is CancelledError:
+                return None
+            if replacement is None:
+                raise
+            raise replacement from ex
 
     return wrapper
 
@@ -168,17 +196,31 @@ def catch_all_exceptions(func):  # noqa: D103
 def valid_login_required(func):  # noqa: D103
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
-        login = (
-            getattr(args[0], "_login", None) if hasattr(args[0], "_login") else [arg for arg in args if hasattr(arg, "_urls")][0]
-        )
+        login = getattr(args[0], "_login", None)
+        if login is None:
+            login = next((arg for arg in args if hasattr(arg, "_urls")), None)
+            if login is None:
+                raise SengledWifipyLoginError(f"{func.__qualname__} was called without a SengledLogin")
 
         if not await login.valid_login():
             await login.login(SkipTest=True)
-        return await func(*args, **kwargs)
+        try:
+            return await func(*args, **kwargs)
+        except SengledWifipyLoginError:
+            # the server rejected the session, do not trust the cached validation for the next call
+            login.expire_validation()
+            raise
 
     return wrapper
 
 
+_STATUS_ERRORS: dict[int, type[Exception]] = {
+    401: SengledWifipyLoginError,
+    429: SengledWifipyTooManyRequestsError,
+}
+"""Error raised by valid_response per HTTP status, any other status >= 400 raises SengledWifipyConnectionError."""
+
+
 async def valid_response(response) -> None:
     """Response validation for aiohttp request.
 
@@ -187,9 +229,6 @@ async def valid_response(response) -> None:
     Returns:
         None
     """
-    if response.status == 401:
-        raise SengledWifipyLoginError(response.reason)
-    if response.status == 429:
-        raise SengledWifipyTooManyRequestsError(response.reason)
-    if response.status >= 400:
-        raise SengledWifipyConnectionError(response.reason)
+    if response.status < 400:
+        return
+    raise _STATUS_ERRORS.get(response.status, SengledWifipyConnectionError)(response.reason)
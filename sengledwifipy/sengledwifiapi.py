@@ -2,15 +2,17 @@
 
 from __future__ import annotations
 
-import json
+import asyncio
+import copy
+import functools
 import logging
 import time
 from typing import TYPE_CHECKING, Any
 
-import backoff
 from aiohttp import ClientConnectionError, ClientResponse
 from yarl import URL
 
+from .const import DEVICES_CACHE_SECONDS
 from .errors import (
     SengledWifipyConnectionError,
     SengledWifipyTooManyRequestsError,
@@ -23,12 +25,76 @@ if TYPE_CHECKING:
 
 from .helpers import (
     catch_all_exceptions,
-    hide_email,
+    json_dumps,
+    json_loads,
     valid_login_required,
 )
 
 _LOGGER = logging.getLogger(__name__)
 
+_HA_COLOR_TRANSLATION = str.maketrans({" ": None, ",": ":", "(": None, ")": None})
+"""Turns a Home Assistant rgb tuple string like '(255, 45, 41)' into the Sengled format '255:45:41'."""
+
+_DEVICE_TIME_OFFSET = 1577858400
+"""Subtracted from the unix time to get the 'time' sent along device updates."""
+
+_device_time_cache: list[int | str] = [0, ""]
+"""Last computed device time in seconds and its string form, reused within the same second."""
+
+
+def _device_time() -> str:
+    """Seconds since the device is up until now, as sent in the update payload."""
+    now = time.time_ns() // 1_000_000_000 - _DEVICE_TIME_OFFSET
+    if _device_time_cache[0] != now:
+        _device_time_cache[0] = now
+        _device_time_cache[1] = str(now)
+    return _device_time_cache[1]
+
+
+_REQUEST_TRIES = 5
+"""Attempts made by SengledWifiAPI._static_request before giving up."""
+
+_REQUEST_MAX_TIME = 60
+"""Seconds after the first attempt of SengledWifiAPI._static_request past which it stops retrying."""
+
+_RETRY_EXCEPTIONS = (SengledWifipyTooManyRequestsError, SengledWifipyConnectionError, ClientConnectionError)
+"""Errors retried by SengledWifiAPI._static_request."""
+
+
+@functools.lru_cache(maxsize=32)
+def _appserver_url(appserver: str, uri: str) -> URL:
+    """Parsed URL of an appserver endpoint; yarl URLs are immutable so they can be shared between requests."""
+    return URL(appserver + uri)
+
+
+def _state_update(
+    entity_id: str,
+    timev: str,
+    power_on: bool = None,
+    brightness: int = None,
+    color: str = None,
+    color_temperature: int = None,
+) -> list[dict[str, str]]:
+    """Payload entries of a device update, see SengledWifiAPI.set_device_state for the arguments."""
+    data = []
+    append = data.append
+    if isinstance(power_on, bool):
+        append({"dn": entity_id, "type": "switch", "value": "1" if power_on else "0", "time": timev})
+    if isinstance(brightness, int):
+        append({"dn": entity_id, "type": "brightness", "value": str(round((brightness / 255) * 100)), "time": timev})
+    if isinstance(color, str):
+        append({"dn": entity_id, "type": "color", "value": str(color).translate(_HA_COLOR_TRANSLATION), "time": timev})
+    if isinstance(color_temperature, int):
+        append(
+            {
+                "dn": entity_id,
+                "type": "colorTemperature",
+                "value": str(round((color_temperature / 6500) * 100)),
+                "time": timev,
+            }
+        )
+    return data
+
 
 class SengledWifiAPI:
     """Uses SengledWifiMqtt and SengledLogin to get information of the devices and set their state.
@@ -37,22 +103,20 @@ class SengledWifiAPI:
         login (SengledLogin):  SengledLogin object
     """
 
-    devices: dict[str, Any] = {}
-    """Class attribute. Saves the devices registered in the related Sengled account."""
+    devices: dict[str, list[dict[str, Any]]] = {}
+    """Class attribute. Last filtered device list returned by get_devices per account."""
+
+    _devices_cache: dict[str, tuple[float, list[dict[str, Any]]]] = {}
+    """Class attribute. time.monotonic(), -inf once expired, and device list of the last device/list.json response per account."""
+
+    _device_list_requests: dict[str, asyncio.Task] = {}
+    """Class attribute. device/list.json request in flight per account, awaited by every concurrent caller."""
 
     def __init__(self, login: SengledLogin) -> None:
         """Initialize Sengled Wifi device."""
         self._login = login
 
     @staticmethod
-    @backoff.on_exception(
-        backoff.expo,
-        (SengledWifipyTooManyRequestsError, SengledWifipyConnectionError, ClientConnectionError),
-        max_time=60,
-        max_tries=5,
-        logger=__name__,
-    )
-    @valid_login_required
     async def _static_request(
         method: str,
         login: SengledLogin,
@@ -69,24 +133,130 @@ class SengledWifiAPI:
             query (dict[str, str]): query parameters
 
         Returns:
-            None or aiohttp ClientResponse
+            None or aiohttp ClientResponse. Connection errors and 429 responses, including the ones of the login \
+                validation, are retried up to _REQUEST_TRIES times and for at most _REQUEST_MAX_TIME seconds, \
+                waiting 0.5s and doubling up to 8s between attempts.
         """
-        url = URL(login.urls["appserver"] + uri).update_query(query)
+        start = time.monotonic()
+        delay = 0.5
+        for attempt in range(_REQUEST_TRIES):
+            try:
+                return await SengledWifiAPI._request(method, login, uri, data, query)
+            except _RETRY_EXCEPTIONS as ex:
+                remaining = _REQUEST_MAX_TIME - (time.monotonic() - start)
+                if attempt == _REQUEST_TRIES - 1 or remaining <= 0:
+                    raise
+                wait = min(delay, remaining)
+                _LOGGER.info("SengledWifiApi: API backing off %s %.1fs after %s", uri, wait, type(ex).__name__)
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, 8)
+
+    @staticmethod
+    @valid_login_required
+    async def _request(
+        method: str,
+        login: SengledLogin,
+        uri: str,
+        data: dict[str, str] = None,
+        query: dict[str, str] = None,
+    ) -> ClientResponse:
+        """Single attempt of _static_request, after validating the login.
 
-        response = await getattr(login.session, method)(url, json=data)
+        Args:
+            login (SengledLogin): needs a valid login
+            uri (str): will use the appserver endpoint with this uri
+            data (dict[str, str]): payload
+            query (dict[str, str]): query parameters
 
-        _LOGGER.debug(f"SengledWifiApi: API {hide_email(login.email)}: \
-                      \n--static {response.request_info.method}: {response.request_info.url} \
-                      \n--returned {response.status}:{response.reason}:{response.content_type}")
+        Returns:
+            aiohttp ClientResponse
+        """
+        url = _appserver_url(login.urls["appserver"], uri)
+        if query:
+            url = url.update_query(query)
+
+        response = await login.session.request(method, url, json=data)
+
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(
+                "SengledWifiApi: API %s:\n--static %s: %s\n--returned %s:%s:%s",
+                login.hidden_email,
+                response.request_info.method,
+                response.request_info.url,
+                response.status,
+                response.reason,
+                response.content_type,
+            )
 
         return response
 
+    @staticmethod
+    async def _get_device_list(login: SengledLogin) -> list[dict[str, Any]]:
+        """Fetch the unfiltered device list of the account, reusing a response younger than DEVICES_CACHE_SECONDS.
+
+        Args:
+            login (SengledLogin): needs a valid login
+
+        Returns:
+            The deviceList of the response
+        """
+        cached = SengledWifiAPI._devices_cache.get(login.email)
+        if cached is not None and time.monotonic() - cached[0] < DEVICES_CACHE_SECONDS:
+            return cached[1]
+
+        request = SengledWifiAPI._device_list_requests.get(login.email)
+        if request is None:
+            request = asyncio.ensure_future(SengledWifiAPI._request_device_list(login))
+            SengledWifiAPI._device_list_requests[login.email] = request
+            request.add_done_callback(functools.partial(SengledWifiAPI._device_list_request_done, login.email))
+        # shield: a cancelled caller must not cancel the request the other callers are waiting for
+        return await asyncio.shield(request)
+
+    @staticmethod
+    def _device_list_request_done(email: str, request: asyncio.Task) -> None:
+        """Done callback of a device/list.json request in flight, forgets it and retrieves its error.
+
+        The error is raised to every caller still waiting, but if all of them were cancelled nobody would retrieve it \
+            and asyncio would log "Task exception was never retrieved".
+        """
+        SengledWifiAPI._device_list_requests.pop(email, None)
+        if not request.cancelled():
+            request.exception()
+
+    @staticmethod
+    async def _request_device_list(login: SengledLogin) -> list[dict[str, Any]]:
+        """Request the device list and store it in _devices_cache.
+
+        Args:
+            login (SengledLogin): needs a valid login
+
+        Returns:
+            The deviceList of the response
+        """
+        response = await SengledWifiAPI._static_request(
+            "post",
+            login,
+            "device/list.json",
+        )
+
+        # the appserver always answers utf-8 json, both orjson and json.loads parse the raw bytes without a decode
+        device_list = json_loads(await response.read())["deviceList"]
+        SengledWifiAPI._devices_cache[login.email] = (time.monotonic(), device_list)
+        return device_list
+
+    @staticmethod
+    def _expire_device_list(email: str) -> None:
+        """Make get_devices request the device list again, keeping the last one in case the request fails."""
+        cached = SengledWifiAPI._devices_cache.get(email)
+        if cached is not None:
+            SengledWifiAPI._devices_cache[email] = (float("-inf"), cached[1])
+
     @staticmethod
     @catch_all_exceptions
     async def get_devices(
         login: SengledLogin,
         entity_ids: list[str] = None,
-    ) -> dict[str, str | int | bool]:
+    ) -> list[dict[str, Any]]:
         """Retrieve all Sengled Wifi Devices or the specified ones via entity_ids arg.
 
         Args:
@@ -95,27 +265,31 @@ class SengledWifiAPI:
                 Optional if all devices information is required. (replaces get_entity_state)
 
         Returns:
-            Json. Device information.
+            Json. Device information. The device list is requested at most once every DEVICES_CACHE_SECONDS per account, \
+                set_device_state invalidates it. If the request fails after its retries, the last device list \
+                of the account is used.
         """
-        response = await SengledWifiAPI._static_request(
-            "post",
-            login,
-            "device/list.json",
-        )
-
-        SengledWifiAPI.devices[login.email] = (
-            [
-                item
-                for item in (await response.json(content_type=None))["deviceList"]
-                if (item["category"] == "wifielement" and (entity_ids is None or item["deviceUuid"] in entity_ids))
-            ]
-            if response
-            else SengledWifiAPI.devices
-        )
+        try:
+            device_list = await SengledWifiAPI._get_device_list(login)
+        except _RETRY_EXCEPTIONS:
+            cached = SengledWifiAPI._devices_cache.get(login.email)
+            if cached is None:
+                raise
+            _LOGGER.debug("SengledWifiApi: API get_devices request failed, using the last known device list")
+            device_list = cached[1]
+
+        wanted = None if entity_ids is None else frozenset(entity_ids)
+        devices = [
+            item
+            for item in device_list
+            if (item["category"] == "wifielement" and (wanted is None or item["deviceUuid"] in wanted))
+        ]
+        SengledWifiAPI.devices[login.email] = devices
 
-        _LOGGER.debug(f"SengledWifiApi: API get_devices returned {SengledWifiAPI.devices[login.email]}")
+        _LOGGER.debug("SengledWifiApi: API get_devices returned %s", devices)
 
-        return SengledWifiAPI.devices[login.email]
+        # the device dicts and their attributeList are shared with the cache and the other callers, hand out copies
+        return copy.deepcopy(devices)
 
     @staticmethod
     @catch_all_exceptions
@@ -135,79 +309,65 @@ class SengledWifiAPI:
             power_on (bool): Should the light be on or off.
             brightness (Optional[int]): 0-255 (translated to 0-100) or None to leave as is
             color (Optional[str]): red(0-255):green(0-255):blue(0-255) or None to leave as is
-            color_temperature (Optional[int]): in kelvin 2500-6500 (translated to 0-100, color '255:45:41') or None to leave as is
+            color_temperature (Optional[int]): in kelvin 2500-6500 (translated to 0-100) or None to leave as is
 
         Returns:
             Bool. True if the publish was successful, False otherwise.
         """
+        data = _state_update(entity_id, _device_time(), power_on, brightness, color, color_temperature)
 
-        def convert_color_HA(hacolor):
-            sengled_color = str(hacolor)
-            for r in ((" ", ""), (",", ":"), ("(", ""), (")", "")):
-                sengled_color = sengled_color.replace(*r)
-            return sengled_color
-
-        power_on = (
-            {
-                "value": ("1" if power_on else "0"),
-                "name": "switch",
-            }
-            if isinstance(power_on, bool)
-            else None
-        )
-        brightness = (
-            {
-                "value": str(round((brightness / 255) * 100)),
-                "name": "brightness",
-            }
-            if isinstance(brightness, int)
-            else None
-        )
-        color = (
-            {
-                "value": convert_color_HA(color),
-                "name": "color",
-            }
-            if isinstance(color, str)
-            else None
-        )
-        color_temperature = (
-            {
-                "value": str(round((color_temperature / 6500) * 100)),
-                "name": "colorTemperature",
-            }
-            if isinstance(color_temperature, int)
-            else None
-        )
-
-        color_temp = (
-            {
-                "value": "255:45:41",
-                "name": "color",
-            }
-            if isinstance(color_temperature, int)
-            else None
-        )
-
-        timev = str(int(time.time()) - 1577858400)
-
-        data = [
-            {
-                "dn": entity_id,
-                "type": option["name"],
-                "value": option["value"],
-                "time": timev,  # seconds since the device is up until now
-            }
-            for option in [power_on, brightness, color, color_temperature, color_temp]
-            if option is not None
-        ]
-
-        _LOGGER.debug(f"SengledWifiApi: API update device state : {data}")
+        _LOGGER.debug("SengledWifiApi: API update device state : %s", data)
 
         if mqttc.publish_mqtt(
             f"wifielement/{entity_id}/update",
-            json.dumps(data),
+            json_dumps(data),
         ):
             _LOGGER.debug("SengledWifiApi: API update device state successful")
+            SengledWifiAPI._expire_device_list(mqttc.login.email)
             return True
         _LOGGER.debug("SengledWifiApi: API update device state error")
+
+    @staticmethod
+    @catch_all_exceptions
+    async def set_device_states(
+        mqttc: SengledWifiMQTT,
+        updates: list[dict[str, Any]],
+    ) -> bool:
+        """Set state of several devices at once, e.g. for a scene.
+
+        Args:
+            mqttc (SengledWifiMQTT): MQTT client
+            updates (list[dict[str, Any]]): each one with the entity_id and any of the set_device_state \
+                arguments power_on, brightness, color and color_temperature. Updates of the same entity_id are merged.
+
+        Returns:
+            Bool. True if all the publishes were successful, False otherwise.
+        """
+        timev = _device_time()
+
+        payloads: dict[str, list[dict[str, str]]] = {}
+        for update in updates:
+            entity_id = update["entity_id"]
+            payloads.setdefault(entity_id, []).extend(
+                _state_update(
+                    entity_id,
+                    timev,
+                    update.get("power_on"),
+                    update.get("brightness"),
+                    update.get("color"),
+                    update.get("color_temperature"),
+                )
+            )
+
+        _LOGGER.debug("SengledWifiApi: API update device states : %s", payloads)
+
+        results = [
+            mqttc.publish_mqtt(f"wifielement/{entity_id}/update", json_dumps(data)) for entity_id, data in payloads.items()
+        ]
+        if any(results):
+            SengledWifiAPI._expire_device_list(mqttc.login.email)
+        if all(results):
+            _LOGGER.debug("SengledWifiApi: API update device states successful")
+            return True
+        _LOGGER.debug("SengledWifiApi: API update device states error")
+        return False
@@ -1,46 +1,149 @@
 """Python Package for controlling Sengled Wifi devices. SPDX-License-Identifier: Apache-2.0."""
 
+import asyncio
 import logging
-import os as oos
+import os
+import time
 from datetime import datetime
-from json import dumps
+from http.cookies import CookieError, Morsel
 from typing import Callable
 from uuid import uuid4
 
-from aiofiles import os
-from aiohttp import ClientResponse, ClientSession, CookieJar
+from aiohttp import ClientResponse, ClientSession, CookieJar, TCPConnector
 from yarl import URL
 
-from .const import EXCEPTION_TEMPLATE, HA_DOMAIN, SENGLED_ENDPOINTS, USER_AGENT
+from .const import (
+    EXCEPTION_TEMPLATE,
+    HA_DOMAIN,
+    LOGIN_URL,
+    SENGLED_ENDPOINTS,
+    SERVER_DETAILS_URL,
+    USER_AGENT,
+    VALID_LOGIN_CACHE_SECONDS,
+    VALID_SESSION_URL,
+)
 from .errors import (
     SengledWifipyLoginError,
 )
 from .helpers import (
     catch_all_exceptions,
     hide_email,
+    json_dumps,
+    json_loads,
     obfuscate,
     valid_response,
 )
 
 _LOGGER = logging.getLogger(__name__)
 
+_COOKIE_DOMAIN_SUFFIX = ".sengled.com"
+"""Only the cookies of sengled.com and its subdomains are saved to the cookie file."""
+
+_SUCCESS_CODES = (200, "200")
+"""messageCode of a successful validSession or serverDetails response, the api sends it as a number or a string."""
+
+_LOGIN_SUCCESS_CODES = (0, "0")
+"""ret of a successful login response."""
+
+_EMPTY_JSON_BODY = b"{}"
+"""Body of the validSession request, which takes no parameters."""
+
+
+def _remove_if_exists(*paths: str) -> bool:
+    """Remove files in a single thread job, instead of checking and removing each one in two.
+
+    Returns:
+        Bool. True if any of the files was removed, False if none of them existed.
+    """
+    removed = False
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed = True
+    return removed
+
+
+def _cookie_deadline(morsel: Morsel) -> float | None:
+    """Absolute expiration of a cookie sent with max-age, saved instead of the max-age that would restart on load."""
+    try:
+        return time.time() + int(morsel["max-age"])
+    except ValueError:
+        return None
+
+
+def _read_cookiefile(path: str, legacy_path: str) -> list[tuple[dict[str, Morsel], URL]] | None:
+    """Read and parse the cookie file in a single thread job.
+
+    The pickled jar of older versions is removed when there is no cookie file yet, it is never loaded.
+
+    Returns:
+        The saved cookies and the url to load each one with, None if the file does not exist or can not be parsed.
+    """
+    try:
+        with open(path, "rb") as file:
+            saved = json_loads(file.read())
+        cookies = []
+        now = time.time()
+        for item in saved:
+            morsel = Morsel()
+            morsel.set(item["key"], item["value"], item["coded_value"])
+            for attr in ("path", "expires"):
+                morsel[attr] = item[attr]
+            if (deadline := item.get("deadline")) is not None:
+                if deadline <= now:
+                    continue
+                morsel["max-age"] = str(int(deadline - now))
+            # a host only cookie is loaded without domain from its host, so it is not sent to the subdomains
+            if not item.get("host_only"):
+                morsel["domain"] = item["domain"]
+            cookies.append(({morsel.key: morsel}, URL.build(scheme="https", host=item["domain"].lstrip("."))))
+    except FileNotFoundError:
+        try:
+            _remove_if_exists(legacy_path)
+        except OSError as ex:
+            _LOGGER.debug(
+                "SengledWifiApi: LOGIN Error deleting legacy cookie, please manually remove: %s",
+                EXCEPTION_TEMPLATE.format(type(ex).__name__, ex.args),
+            )
+        return None
+    except (OSError, ValueError, TypeError, KeyError, AttributeError, CookieError) as ex:
+        _LOGGER.debug(
+            "SengledWifiApi: LOGIN Error loading cookie, ignoring it: %s", EXCEPTION_TEMPLATE.format(type(ex).__name__, ex.args)
+        )
+        return None
+    return cookies
+
+
+def _write_cookiefile(path: str, data: bytes) -> None:
+    """Write the serialized cookies, only readable by the owner as they authenticate the account."""
+    with open(path, "wb", opener=lambda file, flags: os.open(file, flags, 0o600)) as file:
+        file.write(data)
+
 
 class SengledLogin:
     """Handle login connection to Sengled.
 
     Attributes:
         _email (string): Sengled login account
+        _hidden_email (string): _email masked by hide_email, computed once for logging
         _password (string): Password for Sengled login account
         _outputpath (function): os.path.join function pointing to the folder to save a session cookie
-        _urls(dict[str, str]): points to the constant SENGLED_ENDPOINTS which is an initial list of Sengled endpoints
+        _urls(dict[str, str]): copy of the constant SENGLED_ENDPOINTS which is an initial list of Sengled endpoints
         _session (aiohttp.ClientSession): initializes an empty aiohttp.ClientSession to store the cookie information
-        _ssl (ssl): used during the authentication
         _headers (dict[str, str]): based on USER_AGENT constant
         status (dict[str, str | bool]): track if the connection is still valid
-        stats (dict[str, str | bool]): track number of api calls done
+        _stats (dict[str, datetime]): login_timestamp of the last successful login
+        _api_calls (int): number of api calls done
         _cookiefile (str): in combination with _outputpath, provides the path to save the cookie
+        _cookiedir (str): folder of _cookiefile, logged instead of the full path
+        _legacy_cookiefile (str): pickled cookie jar written by older versions, removed instead of loaded
         _customer_id (str): to store the customer id provided by the authentication api
         _data (dict[str,str]): body for the authentication api
+        _data_bytes (bytes): _data serialized once, sent as is on every login
+        _validated_at (float): time.monotonic() of the last successful validation or login, None if there is none
+        _logged_in_at (float): time.monotonic() of the last successful login, None if there is none
     """
 
     hass_domain = HA_DOMAIN
@@ -62,19 +165,24 @@ class SengledLogin:
             uuid: (string): Unique 32 char hex to serve as app serial number for registration
 
         """
-        self._urls: dict[str, str] = SENGLED_ENDPOINTS
+        self._urls: dict[str, str] = dict(SENGLED_ENDPOINTS)
         self._email: str = email
+        self._hidden_email: str = hide_email(email)
         self._password: str = password
         self._session: ClientSession = None
         self._headers: dict[str, str] = {}
         self.status: dict[str, str | bool] = {}
-        self.stats: dict[str, str | bool] = {
+        self._stats: dict[str, datetime] = {
             "login_timestamp": datetime(1, 1, 1),
-            "api_calls": 0,
         }
-        self._outputpath = outputpath if outputpath is not None else (lambda b: oos.path.join("temp", b))
-        self._cookiefile: str = self._outputpath(f".storage/{type(self).hass_domain}.{self.email}.pickle")
+        self._api_calls: int = 0
+        self._outputpath = outputpath if outputpath is not None else (lambda b: os.path.join("temp", b))
+        self._cookiefile: str = self._outputpath(f".storage/{type(self).hass_domain}.{self.email}.json")
+        self._cookiedir: str = os.path.dirname(self._cookiefile)
+        self._legacy_cookiefile: str = self._outputpath(f".storage/{type(self).hass_domain}.{self.email}.pickle")
         self._customer_id: str = None
+        self._validated_at: float | None = None
+        self._logged_in_at: float | None = None
         self._data = {
             "user": self._email,
             "pwd": self._password,
@@ -83,6 +191,7 @@ class SengledLogin:
             "productCode": "life",
             "appCode": "life",
         }
+        self._data_bytes: bytes = json_dumps(self._data)
         self._create_session()
 
     @property
@@ -95,16 +204,39 @@ class SengledLogin:
         """Email account for this Login."""
         return self._email
 
+    @property
+    def hidden_email(self) -> str:
+        """Masked email account for this Login, safe to log."""
+        return self._hidden_email
+
     @property
     def customer_id(self) -> str | None:
         """customer_id for this Login."""
         return self._customer_id
 
+    @property
+    def api_calls(self) -> int:
+        """Number of api calls done by this Login."""
+        return self._api_calls
+
+    @property
+    def stats(self) -> dict[str, datetime | int]:
+        """login_timestamp of the last successful login and number of api calls done."""
+        return {**self._stats, "api_calls": self._api_calls}
+
     @property
     def session(self) -> ClientSession | None:
         """Session for this Login."""
         return self._session
 
+    async def __aenter__(self) -> "SengledLogin":
+        """Use the login as an async context manager, closing its session on exit."""
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        """Close the session."""
+        await self.close()
+
     def _create_session(self) -> None:
         """Create an aiohttp session. Called during the initialization."""
         _LOGGER.debug("SengledWifiApi: LOGIN Creating session")
@@ -116,7 +248,9 @@ class SengledLogin:
                 "Accept-Language": "*",
                 "Content-Type": "application/json",
             }
-            self._session = ClientSession(headers=self._headers, raise_for_status=valid_response)
+            # all calls go to a handful of Sengled hosts: keep their connections and DNS answers around between polls
+            connector = TCPConnector(limit=32, limit_per_host=16, keepalive_timeout=75, ttl_dns_cache=300)
+            self._session = ClientSession(connector=connector, headers=self._headers, raise_for_status=valid_response)
 
     async def valid_login(self) -> bool:
         """Function that will test the connection is logged in.
@@ -126,25 +260,35 @@ class SengledLogin:
         Returns:
             Bool. True if the session is still valid, because the cookies has been created recently.
             False if for some reason the cookie no longer exists or there was an error with the validSession endpoint.
+            A successful result is reused for VALID_LOGIN_CACHE_SECONDS without calling the endpoint again.
         """
-        _LOGGER.debug(f'SengledWifiApi: LOGIN validation of session \
-                      \n--URL {self._urls["validSession"]}  \
-                      \n--Headers {dumps(self._headers)} \
-                      \n--last login: {self.stats["login_timestamp"]} \
-                      \n--hours: {round((datetime.now() - self.stats["login_timestamp"]).total_seconds()/3600)}h ')
-        if (datetime.now() - self.stats["login_timestamp"]).total_seconds() < 86400 and await os.path.exists(self._cookiefile):
-            if len(self._session.cookie_jar) == 0:
-                self._session.cookie_jar.load(self._cookiefile)
-
-            _LOGGER.debug("SengledWifiApi: LOGIN calling validation api")
-            resp = await self._static_request("post", url=self._urls["validSession"], data={})
-            resp = await resp.json()
-
-            if resp and int(resp.get("messageCode")) == 200:
-                _LOGGER.debug("SengledWifiApi: LOGIN login validation with cookie successful")
-                return True
-            _LOGGER.debug(f"SengledWifiApi: LOGIN validation api response not successful: {resp}")
-        _LOGGER.debug("SengledWifiApi: LOGIN login not valid, either the login is old >24h or cookie is not valid")
+        if self._validated_at is not None and time.monotonic() - self._validated_at < VALID_LOGIN_CACHE_SECONDS:
+            return True
+
+        login_age = None if self._logged_in_at is None else time.monotonic() - self._logged_in_at
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(
+                "SengledWifiApi: LOGIN validation of session\n--URL %s\n--Headers %s\n--last login: %s\n--hours: %sh",
+                VALID_SESSION_URL,
+                self._headers,
+                self._stats["login_timestamp"],
+                None if login_age is None else round(login_age / 3600),
+            )
+        # without a recent login or a usable cookie file the validation api can only fail, skip the request
+        if login_age is None or login_age >= 86400 or not await self._load_cookiefile():
+            _LOGGER.debug("SengledWifiApi: LOGIN login not valid, either the login is old >24h or there is no cookie")
+            await self.reset()
+            return False
+
+        _LOGGER.debug("SengledWifiApi: LOGIN calling validation api")
+        resp = await self._static_request("post", url=VALID_SESSION_URL, data=_EMPTY_JSON_BODY)
+        resp = json_loads(await resp.read())
+
+        if resp and resp.get("messageCode") in _SUCCESS_CODES:
+            _LOGGER.debug("SengledWifiApi: LOGIN login validation with cookie successful")
+            self._validated_at = time.monotonic()
+            return True
+        _LOGGER.debug("SengledWifiApi: LOGIN validation api response not successful: %s", resp)
 
         await self.reset()
         return False
@@ -164,51 +308,94 @@ class SengledLogin:
                 return
 
         _LOGGER.debug("SengledWifiApi: LOGIN Using credentials to login")
+        # a failed login must not leave an earlier validation behind
+        self.expire_validation()
 
-        post_resp = await self._static_request("post", url=self._urls["login"], data=self._data)
-        post_resp = await post_resp.json()
+        post_resp = await self._static_request("post", url=LOGIN_URL, data=self._data_bytes)
+        post_resp = json_loads(await post_resp.read())
 
-        if post_resp and int(post_resp.get("ret")) == 0:
-            _LOGGER.debug(f"SengledWifiApi: LOGIN Login successful for {hide_email(self._email)}; saving cookie")
+        if post_resp and post_resp.get("ret") in _LOGIN_SUCCESS_CODES:
+            _LOGGER.debug("SengledWifiApi: LOGIN Login successful for %s; saving cookie", self._hidden_email)
             self._customer_id = post_resp.get("customerId")
             self.status["login_successful"] = True
-            self.stats["login_timestamp"] = datetime.now()
-            await self.save_cookiefile()
-            await self._get_server_info()
+            self._stats["login_timestamp"] = datetime.now()
+            self._logged_in_at = time.monotonic()
+            # the cookie file is written in a worker thread while the serverDetails request is in flight, both are
+            # awaited before raising the first error so none of them keeps changing the login after it failed
+            for result in await asyncio.gather(self.save_cookiefile(), self._get_server_info(), return_exceptions=True):
+                if isinstance(result, BaseException):
+                    raise result
+            self._validated_at = time.monotonic()
             return
-        _LOGGER.debug(f"SengledWifiApi: LOGIN Login not possible for {hide_email(self._email)}")
+        _LOGGER.debug("SengledWifiApi: LOGIN Login not possible for %s", self._hidden_email)
 
     async def save_cookiefile(self) -> None:
-        """Save login session cookie to file."""
+        """Save the sengled.com session cookies to file, as a json list of their attributes and host only flag."""
         cookie_jar = self._session.cookie_jar
         assert isinstance(cookie_jar, CookieJar)
+        # depending on the aiohttp version the host only cookies are keyed by (domain, name) or (domain, path, name)
+        host_only = getattr(cookie_jar, "_host_only_cookies", ())
 
-        _LOGGER.debug(f'SengledWifiApi: LOGIN Saving cookie to {self._cookiefile.split("/")[0]}')
+        _LOGGER.debug("SengledWifiApi: LOGIN Saving cookie to %s", self._cookiedir)
         try:
-            await self.delete_cookie()
-            cookie_jar.save(self._cookiefile)
+            data = json_dumps(
+                [
+                    {
+                        "key": morsel.key,
+                        "value": morsel.value,
+                        "coded_value": morsel.coded_value,
+                        "domain": morsel["domain"],
+                        "path": morsel["path"],
+                        "expires": morsel["expires"],
+                        "deadline": _cookie_deadline(morsel),
+                        "host_only": (morsel["domain"], morsel.key) in host_only
+                        or (morsel["domain"], morsel["path"].rstrip("/"), morsel.key) in host_only,
+                    }
+                    for morsel in cookie_jar
+                    if f".{morsel['domain']}".endswith(_COOKIE_DOMAIN_SUFFIX)
+                ]
+            )
+            # opening the file for writing truncates it, no need to delete it first
+            await asyncio.to_thread(_write_cookiefile, self._cookiefile, data)
         except (OSError, EOFError, TypeError, AttributeError) as ex:
-            _LOGGER.debug(f'SengledWifiApi: LOGIN Error saving pickled cookie to {self._cookiefile.split("/")[0]} .... \
-                          \n--{EXCEPTION_TEMPLATE.format(type(ex).__name__, ex.args)}')
+            _LOGGER.debug(
+                "SengledWifiApi: LOGIN Error saving cookie to %s ....\n--%s",
+                self._cookiedir,
+                EXCEPTION_TEMPLATE.format(type(ex).__name__, ex.args),
+            )
             raise SengledWifipyLoginError
 
-        _LOGGER.debug(f"SengledWifiApi: LOGIN Saved session Cookies: \
-                      \n--{await self._print_session_cookies()}")
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("SengledWifiApi: LOGIN Saved session Cookies:\n--%s", await self._print_session_cookies())
+
+    async def _load_cookiefile(self) -> bool:
+        """Load the cookie file into an empty session cookie jar, reading and parsing it in a single thread job.
+
+        Returns:
+            Bool. True if the cookie file exists and could be loaded, False otherwise.
+        """
+        cookie_jar = self._session.cookie_jar
+        if len(cookie_jar):
+            return await asyncio.to_thread(os.path.exists, self._cookiefile)
+
+        cookies = await asyncio.to_thread(_read_cookiefile, self._cookiefile, self._legacy_cookiefile)
+        if cookies is None:
+            return False
+        for cookie, response_url in cookies:
+            cookie_jar.update_cookies(cookie, response_url)
+        return True
 
     async def _print_session_cookies(self) -> str:
         """Prints the value of the cookies in aiohttp session."""
-        result: str = ""
         if not self._session.cookie_jar:
-            result = "Session cookie jar is empty."
-        for cookie in self._session.cookie_jar:
-            result += f"{obfuscate(cookie)}"
-        return result
+            return "Session cookie jar is empty."
+        return "".join([str(obfuscate(cookie)) for cookie in self._session.cookie_jar])
 
     async def _static_request(
         self,
         method: str,
         url: str,
-        data: dict[str, str] = None,
+        data: bytes = None,
         query: dict[str, str] = None,
     ) -> ClientResponse:
         """Call an API.
@@ -216,32 +403,41 @@ class SengledLogin:
         Args:
             login (SengledLogin): needs a valid login
             uri (str): will use the appserver endpoint with this uri
-            data (dict[str, str]): payload
+            data (bytes): payload already serialized to json, the session sends it as application/json
             query (dict[str, str]): query parameters
 
         Returns:
             None or aiohttp ClientResponse
         """
-        url = URL(url).update_query(query)
-
-        response = await getattr(self._session, method)(url, json=data)
-
-        _LOGGER.debug(f"SengledWifiApi: LOGIN API CALL {hide_email(self._email)}: \
-                      \n--static {response.request_info.method}: {response.request_info.url} \
-                      \n--returned {response.status}:{response.reason}:{response.content_type}")
+        url = URL(url)
+        if query:
+            url = url.update_query(query)
+
+        response = await self._session.request(method, url, data=data)
+
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(
+                "SengledWifiApi: LOGIN API CALL %s:\n--static %s: %s\n--returned %s:%s:%s",
+                self._hidden_email,
+                response.request_info.method,
+                response.request_info.url,
+                response.status,
+                response.reason,
+                response.content_type,
+            )
 
-        self.stats["api_calls"] += 1
+        self._api_calls += 1
 
         return response
 
     async def _get_server_info(self) -> None:
         """Call to serverDetails endpoint to get Mqtt related endpoints. Called from Login."""
-        _LOGGER.debug("SengledWifiApi: LOGIN Getting server endpoints from: %s", self._urls["serverDetails"])
+        _LOGGER.debug("SengledWifiApi: LOGIN Getting server endpoints from: %s", SERVER_DETAILS_URL)
 
-        post_resp = await self._static_request("post", url=self._urls["serverDetails"])
-        post_resp = await post_resp.json()
+        post_resp = await self._static_request("post", url=SERVER_DETAILS_URL)
+        post_resp = json_loads(await post_resp.read())
 
-        if int(post_resp.get("messageCode")) == 200:
+        if post_resp.get("messageCode") in _SUCCESS_CODES:
             self._urls.update(
                 {
                     "appserver": post_resp.get("appServerAddr"),
@@ -249,35 +445,41 @@ class SengledLogin:
                     "mqttport": post_resp.get("mqttSslPort"),
                 }
             )
-            _LOGGER.debug(f"SengledWifiApi: LOGIN Success getting endpoints: \n {dumps(self._urls)}")
+            _LOGGER.debug("SengledWifiApi: LOGIN Success getting endpoints:\n %s", self._urls)
         return
 
     async def close(self) -> None:
         """Close connection for login."""
         if self._session and not self._session.closed:
-            if self._session._connector_owner:
-                assert self._session._connector is not None
-                await self._session._connector.close()
-            self._session._connector = None
+            await self._session.close()
+
+    def expire_validation(self) -> None:
+        """Forget the last successful validation so the next valid_login asks the server again."""
+        self._validated_at = None
 
     async def reset(self) -> None:
         """Remove data related to existing login."""
-        _LOGGER.debug(f"SengledWifiApi: LOGIN reset login for {hide_email(self._email)}")
-        await self.close()
-        self._session = None
+        _LOGGER.debug("SengledWifiApi: LOGIN reset login for %s", self._hidden_email)
         self.status = {}
+        self.expire_validation()
         await self.delete_cookie()
-        self._create_session()
+        if self._session is None or self._session.closed:
+            self._session = None
+            self._create_session()
+        else:
+            # keep the session and its open connections, only the cookies of the old login are dropped
+            self._session.cookie_jar.clear()
 
     async def delete_cookie(self) -> None:
         """Deletes the session cookie."""
-        _LOGGER.debug(f'SengledWifiApi: LOGIN Deleting cookiefile {self._cookiefile.split("/")[0]} ')
+        _LOGGER.debug("SengledWifiApi: LOGIN Deleting cookiefile in %s", self._cookiedir)
 
-        if await os.path.exists(self._cookiefile):
-            try:
-                await os.remove(self._cookiefile)
+        try:
+            if await asyncio.to_thread(_remove_if_exists, self._cookiefile, self._legacy_cookiefile):
                 _LOGGER.debug("SengledWifiApi: LOGIN Deleting cookiefile successful")
-                return
-            except (OSError, EOFError, TypeError, AttributeError) as ex:
-                _LOGGER.debug(f"SengledWifiApi: LOGIN Error deleting cookie: \
-                              \n{EXCEPTION_TEMPLATE.format(type(ex).__name__, ex.args)}; please manually remove")
+        except (OSError, EOFError, TypeError, AttributeError) as ex:
+            _LOGGER.debug(
+                "SengledWifiApi: LOGIN Error deleting cookie in %s:\n--%s; please manually remove",
+                self._cookiedir,
+                EXCEPTION_TEMPLATE.format(type(ex).__name__, ex.args),
+            )
@@ -3,21 +3,37 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
+import socket
+from collections import deque
 from typing import TYPE_CHECKING, Any, Callable, Coroutine
 
 from paho.mqtt import client as mqtt
 from paho.mqtt import enums as mqttenums
 from yarl import URL
 
-from .helpers import valid_login_required
+from .helpers import json_loads, valid_login_required
 
 if TYPE_CHECKING:
     from .sengledwifilogin import SengledLogin
 
 _LOGGER = logging.getLogger(__name__)
 
+_INBOX_SIZE = 1000
+"""Messages kept in SengledWifiMQTT.inbox and in the parsing queue, the oldest are dropped if msg_callback does not drain them."""
+
+_TOPIC_PREFIX = "wifielement/"
+"""Start of the device topics, followed by the device id."""
+
+_KEEPALIVE = 60
+"""Seconds between the pings paho sends to the broker when there is no other traffic."""
+
+_MISC_INTERVAL = 1
+"""Seconds between the loop_misc calls checking the keepalive, as often as paho's own loop does."""
+
+_RECONNECT_DELAY_MAX = 120
+"""Upper bound in seconds of the doubling wait between reconnection attempts, same as paho's default."""
+
 
 class SengledWifiMQTT:
     """Connect to Sengled MQTT broker, subscribe to topics and publish updates. Uses paho-mqtt package.
@@ -26,15 +42,30 @@ class SengledWifiMQTT:
         _login (SengledLogin): SengledLogin object
         _jsession_id (SengledLogin session JSESSIONID): value of cookie JSESSIONID saved in SengledLogin session
         mqtt_server (URL): url is obtained during the login and fetched from SengledLogin object
+        _mqtt_host (str): host of mqtt_server, read once instead of on every (re)connection
+        _mqtt_port (int): port of mqtt_server
         mqtt_client (paho.mqtt.client): initialization of paho.mqtt client with same headers used in Android app
         _status (bool): to indicate if mqtt connection is active
         devices (list[dict[str, str]]): list of Sengled devices, used to create the topic strings and subscribe, \
             during the initialization is set to None
+        _topics (list[tuple[str, int]]): status topic and qos of each device, subscribed on every (re)connection
         open_callback (Callable): an async function to call within the on_connect callback
-        msg_callback (Callable): an async function to call within the on_message callback
+        msg_callback (Callable): an async function to call within the on_message callback. It is called once \
+            per burst of messages and should drain inbox, only one call runs at a time
+        inbox (deque[dict[str, Any]]): parsed messages (id, time, attributes) waiting for msg_callback
         close_callback (Callable): an async function to call within the on_disconnect callback
         error_callback (Callable): an async function to call within the on_error callback
-        _loop (asyncio.AbstractEventLoop): used for callbacks
+        _loop (asyncio.AbstractEventLoop): runs the paho network loop and the callbacks
+        _tasks (set[asyncio.Task]): callback tasks that are still running
+        _raw_inbox (deque[tuple[str, bytes]]): device id and payload of the messages received but not parsed yet
+        _inbox_task (asyncio.Task): task parsing _raw_inbox into inbox and calling msg_callback, \
+            None if it has not been started
+        _sock_fd (int): file descriptor of the broker connection watched by _loop, None when there is none
+        _misc_handle (asyncio.TimerHandle): next loop_misc call, None when there is no connection
+        _reconnect_task (asyncio.Task): reconnection attempts after an unexpected disconnection, None if never started
+        _connecting (bool): async_connect or _reconnect is connecting in a worker thread
+        _loop_started (bool): paho's network loop runs in its own thread, started with loop_start() by a call \
+            made while _loop was not running. The socket is not watched by _loop from then on
     """
 
     def __init__(
@@ -54,18 +85,30 @@ class SengledWifiMQTT:
             open_callback (Callable): callback function when connection is opened.
             close_callback (Callable): callback function when when the connection is closed.
             error_callback (Callable): callback function when there is an error.
-            loop: (asyncio.AbstractEventLoop).
+            loop: (asyncio.AbstractEventLoop). Defaults to the running loop, required when created outside of one.
         """
         self._login = login
         self._jsession_id = self._login.session.cookie_jar.filter_cookies("https://sengled.com")["JSESSIONID"].value
         self._status: bool = False
         self.devices: dict = None
+        self._topics: list[tuple[str, int]] = []
         self.open_callback: Callable[[], Coroutine[Any, Any, None]] = open_callback
         self.msg_callback: Callable[[], Coroutine[Any, Any, None]] = msg_callback
         self.close_callback: Callable[[], Coroutine[Any, Any, None]] = close_callback
         self.error_callback: Callable[[str], Coroutine[Any, Any, None]] = error_callback
-        self._loop: asyncio.AbstractEventLoop = loop if loop else asyncio.get_event_loop()
+        self._loop: asyncio.AbstractEventLoop = loop or asyncio.get_running_loop()
+        self._tasks: set[asyncio.Task] = set()
+        self.inbox: deque[dict[str, Any]] = deque(maxlen=_INBOX_SIZE)
+        self._raw_inbox: deque[tuple[str, bytes]] = deque(maxlen=_INBOX_SIZE)
+        self._inbox_task: asyncio.Task | None = None
+        self._sock_fd: int | None = None
+        self._misc_handle: asyncio.TimerHandle | None = None
+        self._reconnect_task: asyncio.Task | None = None
+        self._connecting: bool = False
+        self._loop_started: bool = False
         self.mqtt_server = URL(login.urls["mqtt"])
+        self._mqtt_host: str = self.mqtt_server.host
+        self._mqtt_port: int = self.mqtt_server.port
         self.mqtt_client = mqtt.Client(
             callback_api_version=mqttenums.CallbackAPIVersion.VERSION2,
             client_id=f"{self._jsession_id}@lifeApp",
@@ -83,7 +126,19 @@ class SengledWifiMQTT:
         self.mqtt_client.on_connect = self.on_connect
         self.mqtt_client.on_disconnect = self.on_disconnect
         self.mqtt_client.on_subscribe = self.on_subscribe
-        self.mqtt_client.on_log = self.on_log
+        # paho's network loop runs on _loop through these instead of a loop_start() thread
+        self.mqtt_client.on_socket_open = self.on_socket_open
+        self.mqtt_client.on_socket_close = self.on_socket_close
+        self.mqtt_client.on_socket_register_write = self.on_socket_register_write
+        self.mqtt_client.on_socket_unregister_write = self.on_socket_unregister_write
+        # paho calls on_log for every packet, only pay for it when the logs are going to be written
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            self.mqtt_client.on_log = self.on_log
+
+    @property
+    def login(self) -> SengledLogin:
+        """SengledLogin object used by this MQTT client."""
+        return self._login
 
     @valid_login_required
     async def async_connect(self, devices: dict = None) -> None:
@@ -95,16 +150,183 @@ class SengledWifiMQTT:
         Returns:
             None
         """
-        _LOGGER.debug(f"SengledWifiApi: MQTT Initialize the connection, {self.mqtt_server.host}, {self.mqtt_server.port}")
+        _LOGGER.debug("SengledWifiApi: MQTT Initialize the connection, %s, %s", self._mqtt_host, self._mqtt_port)
         self.devices = devices
+        self._topics = [(f"wifielement/{device['deviceUuid']}/status", 2) for device in devices or ()]
 
-        self.mqtt_client.connect_async(
-            self.mqtt_server.host,
-            port=self.mqtt_server.port,
-            keepalive=60,
-        )
+        await self._connect()
+
+    async def _connect(self) -> None:
+        """Connect with sync_connect in a worker thread, retrying with _reconnect if the broker can not be reached."""
+        if self._connecting:
+            _LOGGER.debug("SengledWifiApi: MQTT connection already in progress")
+            return
+        try:
+            await self._connect_in_thread(self.sync_connect)
+        except OSError as ex:
+            _LOGGER.debug("SengledWifiApi: MQTT connection error: %s", ex)
+            self._start_reconnect()
+
+    def _start_connect(self) -> None:
+        """Start _connect from a task, unless a connection is already open or being opened."""
+        if self._sock_fd is None and not self._connecting:
+            self._create_task(self._connect())
+
+    def _start_network_thread(self) -> None:
+        """Hand the connection over to paho's own network thread, nothing else reads or writes it while _loop is stopped."""
+        if self._loop_started:
+            return
+        self._loop_started = True
+        _LOGGER.debug("SengledWifiApi: MQTT event loop not running, starting the paho network thread")
+        connected = self._sock_fd is not None or self._connecting
+        self._unwatch_socket()
+        if not connected:
+            # the network thread opens the connection itself and keeps reconnecting it
+            self.mqtt_client.connect_async(self._mqtt_host, port=self._mqtt_port, keepalive=_KEEPALIVE)
         self.mqtt_client.loop_start()
 
+    async def _connect_in_thread(self, connect: Callable[[], None]) -> None:
+        """Run connect in a worker thread, flagged by _connecting so no other connection is started meanwhile."""
+        self._connecting = True
+        try:
+            # the dns lookup and the tls and websocket handshakes block, keep them off the event loop
+            await asyncio.to_thread(connect)
+        finally:
+            self._connecting = False
+
+    async def _reconnect(self) -> None:
+        """Reconnect to the broker, waiting 1s and doubling up to _RECONNECT_DELAY_MAX between attempts."""
+        delay = 1
+        while True:
+            await asyncio.sleep(delay)
+            if self._sock_fd is not None or self._connecting:
+                # async_connect, sync_connect or publish_mqtt opened a connection in the meantime
+                return
+            try:
+                await self._connect_in_thread(self.mqtt_client.reconnect)
+                return
+            except OSError as ex:
+                delay = min(delay * 2, _RECONNECT_DELAY_MAX)
+                _LOGGER.debug("SengledWifiApi: MQTT reconnection error, retrying in %ss: %s", delay, ex)
+
+    def _start_reconnect(self) -> None:
+        """Start _reconnect, unless it is already running."""
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = self._loop.create_task(self._reconnect())
+
+    def _call_in_loop(self, callback: Callable[..., Any], *args: Any) -> None:
+        """Call callback right away on the event loop thread, or schedule it there from the connecting thread."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def _watch_socket(self, fd: int) -> None:
+        """Drive paho's network loop from _loop for the new broker connection, instead of any previous one."""
+        self._unwatch_socket()
+        self._sock_fd = fd
+        self._loop.add_reader(fd, self._loop_read)
+        if self._misc_handle:
+            self._misc_handle.cancel()
+        self._misc_handle = self._loop.call_later(_MISC_INTERVAL, self._loop_misc)
+
+    def _unwatch_socket(self) -> None:
+        """Stop driving paho's network loop, the broker connection is being closed."""
+        if self._sock_fd is None:
+            return
+        self._loop.remove_reader(self._sock_fd)
+        self._loop.remove_writer(self._sock_fd)
+        self._sock_fd = None
+        if self._misc_handle:
+            self._misc_handle.cancel()
+            self._misc_handle = None
+
+    def _loop_read(self) -> None:
+        """Reader callback. Also reads the bytes already decrypted by the ssl layer, the socket does not signal them."""
+        rc = self.mqtt_client.loop_read()
+        sock = self.mqtt_client.socket()
+        while rc == mqtt.MQTT_ERR_SUCCESS and sock is not None and getattr(sock, "pending", int)():
+            rc = self.mqtt_client.loop_read()
+            sock = self.mqtt_client.socket()
+
+    def _loop_misc(self) -> None:
+        """Timer callback. Lets paho send the keepalive pings and notice a broker that stopped answering them."""
+        if self.mqtt_client.loop_misc() == mqtt.MQTT_ERR_SUCCESS and self._sock_fd is not None:
+            self._misc_handle = self._loop.call_later(_MISC_INTERVAL, self._loop_misc)
+
+    def _create_task(self, coro: Coroutine[Any, Any, None]) -> None:
+        """Start a callback task, keeping a reference so it is not garbage collected before it finishes."""
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def on_socket_open(self, mqttc, userdata, sock) -> None:
+        """Callback. Called just after the socket was opened, before the CONNECT packet is sent.
+
+        Disables Nagle's algorithm, paho does not, so the small update packets are sent right away \
+            instead of waiting for the ack of the previous one.
+
+        Args:
+            mqttc (Client): the client instance for this callback
+            userdata: the private user data as set in Client() or user_data_set()
+            sock (SocketLike): the socket which was just opened, wrapped by paho for the websockets transport
+
+        Returns:
+            None
+        """
+        try:
+            getattr(sock, "_socket", sock).setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (AttributeError, OSError) as ex:
+            _LOGGER.debug("SengledWifiApi: MQTT could not set TCP_NODELAY: %s", ex)
+        if not self._loop_started:
+            self._call_in_loop(self._watch_socket, sock.fileno())
+
+    def on_socket_close(self, mqttc, userdata, sock) -> None:
+        """Callback. Called just before the socket is closed, stops watching it.
+
+        Args:
+            mqttc (Client): the client instance for this callback
+            userdata: the private user data as set in Client() or user_data_set()
+            sock (SocketLike): the socket which is about to be closed
+
+        Returns:
+            None
+        """
+        if not self._loop_started:
+            self._call_in_loop(self._unwatch_socket)
+
+    def on_socket_register_write(self, mqttc, userdata, sock) -> None:
+        """Callback. Called when paho has packets to send, writes them once the socket is writable.
+
+        Args:
+            mqttc (Client): the client instance for this callback
+            userdata: the private user data as set in Client() or user_data_set()
+            sock (SocketLike): the socket to write to
+
+        Returns:
+            None
+        """
+        if not self._loop_started:
+            self._call_in_loop(self._loop.add_writer, sock.fileno(), self.mqtt_client.loop_write)
+
+    def on_socket_unregister_write(self, mqttc, userdata, sock) -> None:
+        """Callback. Called when paho has sent all the queued packets.
+
+        Args:
+            mqttc (Client): the client instance for this callback
+            userdata: the private user data as set in Client() or user_data_set()
+            sock (SocketLike): the socket that was written to
+
+        Returns:
+            None
+        """
+        if not self._loop_started:
+            self._call_in_loop(self._loop.remove_writer, sock.fileno())
+
     def on_connect(self, mqttc, userdata, flags, rc, properties) -> None:
         """Callback. Called when the broker responds to our connection request.
 
@@ -123,26 +345,21 @@ class SengledWifiMQTT:
             None
         """
         if rc == 0:
-            _LOGGER.debug(f"SengledWifiApi: MQTT open connection result: {rc}")
-
-            topics = [
-                (
-                    "wifielement/" + device["deviceUuid"] + "/status",
-                    2,
-                )
-                for device in self.devices
-            ]
-            self.mqtt_client.subscribe(topics)
+            _LOGGER.debug("SengledWifiApi: MQTT open connection result: %s", rc)
+
+            if self._topics:
+                self.mqtt_client.subscribe(self._topics)
             self._status = True
             if self.open_callback:
-                asyncio.run_coroutine_threadsafe(self.open_callback(), self._loop)
+                self._create_task(self.open_callback())
             return
-        _LOGGER.debug(f"SengledWifiApi: MQTT open connection error: {rc} ")
+        _LOGGER.debug("SengledWifiApi: MQTT open connection error: %s", rc)
 
     def on_message(self, mqttc, userdata, msg) -> None:
         """Callback. Called when a message has been received from mqtt broker.
 
-            Parses the message and then calls the async function msg_callback defined.
+            Queues the message and then parses it into inbox and calls the async function msg_callback defined \
+                from a task, so the socket reads of a burst are not held up by the parsing.
 
         Args:
             mqttc (Client): the client instance for this callback
@@ -152,23 +369,57 @@ class SengledWifiMQTT:
         Returns:
             None
         """
-        _LOGGER.debug(f"SengledWifiApi: MQTT Message received: \
-                      \n{msg.dup}, {msg.info}, {msg.mid}, {msg.payload}, \
-                      \n{msg.properties}, {msg.qos}, {msg.retain}, {msg.state}, {msg.timestamp}....")
-
-        if msg.topic.split("/")[0] != "wifielement":
+        topic = msg.topic
+        if not topic.startswith(_TOPIC_PREFIX):
             _LOGGER.debug("SengledWifiApi: MQTT Message unexpected topic")
             return
-
-        device = dict(id=msg.topic.split("/")[1], time=json.loads(msg.payload.decode("utf-8"))[0]["time"], attributes=dict())
-
-        for attrs in json.loads(msg.payload.decode("utf-8")):
-            device["attributes"][attrs["type"]] = attrs["value"]
-
-        _LOGGER.debug(f"SengledWifiApi: MQTT Message parsed: {device}")
+        end = topic.find("/", len(_TOPIC_PREFIX))
+        device_id = topic[len(_TOPIC_PREFIX) : end] if end != -1 else topic[len(_TOPIC_PREFIX) :]
+
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(
+                "SengledWifiApi: MQTT Message received:\n%s, %s, %s, %s,\n%s, %s, %s, %s, %s....",
+                msg.dup,
+                msg.info,
+                msg.mid,
+                msg.payload,
+                msg.properties,
+                msg.qos,
+                msg.retain,
+                msg.state,
+                msg.timestamp,
+            )
 
         if self.msg_callback:
-            asyncio.run_coroutine_threadsafe(self.msg_callback(), self._loop)
+            self._raw_inbox.append((device_id, msg.payload))
+            if self._inbox_task is None or self._inbox_task.done():
+                self._inbox_task = self._loop.create_task(self._process_inbox())
+
+    async def _process_inbox(self) -> None:
+        """Parse the queued messages into inbox and call msg_callback, again if more arrived during the call."""
+        raw_inbox = self._raw_inbox
+        while raw_inbox:
+            while raw_inbox:
+                device_id, payload = raw_inbox.popleft()
+                try:
+                    # paho hands the payload over as bytes, which json_loads parses without decoding it first
+                    updates = json_loads(payload)
+                    device = {
+                        "id": device_id,
+                        "time": updates[0]["time"],
+                        "attributes": {attrs["type"]: attrs["value"] for attrs in updates},
+                    }
+                except (ValueError, LookupError, TypeError) as ex:
+                    _LOGGER.debug("SengledWifiApi: MQTT Message could not be parsed: %s, %s", payload, ex)
+                    continue
+                _LOGGER.debug("SengledWifiApi: MQTT Message parsed: %s", device)
+                self.inbox.append(device)
+            if self.inbox:
+                try:
+                    await self.msg_callback()
+                except Exception:
+                    # the task would end silently and leave the next messages queued until another one arrives
+                    _LOGGER.exception("SengledWifiApi: MQTT msg_callback error")
 
     def on_subscribe(self, mqttc, userdata, mid, rc_list, properties):
         """Callback. Called when the broker responds to a subscription request.
@@ -184,7 +435,7 @@ class SengledWifiMQTT:
         Returns:
             None
         """
-        _LOGGER.debug(f"SengledWifiApi: MQTT subscribe result: {mid}")
+        _LOGGER.debug("SengledWifiApi: MQTT subscribe result: %s", mid)
 
     def on_log(self, mqttc, userdata, level, buf):
         """Callback. Called when the client has log information. Only used when the logger is set to debug.
@@ -199,8 +450,7 @@ class SengledWifiMQTT:
         Returns:
             None
         """
-        _LOGGER.debug(f"SengledWifiApi: MQTT log received: {buf}")
-        self._status = False
+        _LOGGER.debug("SengledWifiApi: MQTT log received: %s", buf)
 
     def on_disconnect(self, mqttc, userdata, flags, rc, properties):
         """Callback. Called when there is an issue with the connection to the mqtt broker.
@@ -216,40 +466,56 @@ class SengledWifiMQTT:
         Returns:
             None
         """
-        _LOGGER.debug(f"SengledWifiApi: MQTT disconnected: {rc}")
+        _LOGGER.debug("SengledWifiApi: MQTT disconnected: %s", rc)
         self._status = False
+        # paho's network thread reconnects by itself
+        if rc != 0 and not self._loop_started:
+            self._call_in_loop(self._start_reconnect)
 
     def sync_connect(self) -> None:
-        """An alternative connection method to connect without asyncio."""
+        """Connect to the broker blocking the caller, the event loop drives the connection once it is open."""
         self.mqtt_client.connect(
-            self.mqtt_server.host,
-            port=self.mqtt_server.port,
-            keepalive=60,
+            self._mqtt_host,
+            port=self._mqtt_port,
+            keepalive=_KEEPALIVE,
         )
 
-    def publish_mqtt(self, topic: str, payload: str) -> bool:
+    def _ensure_connected(self) -> bool:
+        """Make sure the connection is open or being opened, without blocking a running event loop.
+
+        While _loop runs the connection is opened by a _connect task, and while it is stopped by paho's network thread.
+
+        Returns:
+            True if the client can be used, paho reports MQTT_ERR_NO_CONN while its network thread is still connecting. \
+                False if _loop runs and the connection is not open yet.
+        """
+        if not self._loop.is_running():
+            self._start_network_thread()
+            return True
+        if self.mqtt_client.is_connected():
+            return True
+        self._call_in_loop(self._start_connect)
+        return False
+
+    def publish_mqtt(self, topic: str, payload: str | bytes, qos: int = 0) -> bool:
         """Publish an MQTT message.
 
         Args:
             topic (str): topic to publish the message on
-            payload (str): message to send as string in json format
+            payload (str | bytes): message to send in json format, bytes are sent as is without encoding
+            qos (int): quality of service, paho handles the acknowledgements of QoS 1 and 2 in the network loop
         Returns:
-            True if publish was successful or False if there was an issue
+            True if publish was successful or False if there was an issue. The call does not wait, \
+                True means the message was handed over to the network loop.
         """
-        if not self.mqtt_client.is_connected():
-            _LOGGER.debug("SengledWifiApi: MQTT Publish - not connected, trying to connect and publish")
-            self.sync_connect()
-            self.mqtt_client.loop_start()
-
-        r = self.mqtt_client.publish(topic, payload=payload, qos=0)
-        _LOGGER.debug(f"SengledWifiApi: MQTT Publish message {r.rc}")
-        try:
-            r.wait_for_publish()
-            return r.is_published()
-        except ValueError:
-            pass
+        if not self._ensure_connected():
+            _LOGGER.debug("SengledWifiApi: MQTT Publish - not connected, connecting, message not sent")
+            return False
 
-        return False
+        r = self.mqtt_client.publish(topic, payload=payload, qos=qos)
+        _LOGGER.debug("SengledWifiApi: MQTT Publish message %s", r.rc)
+        # waiting for the acknowledgement would block the event loop that has to read it
+        return r.rc == mqtt.MQTT_ERR_SUCCESS
 
     def subscribe_mqtt(self, topic: tuple[str, str] | list[tuple[str, str]], callback: Callable[[]] = None) -> bool:
         """Subscribe to an MQTT topic.
@@ -258,11 +524,13 @@ class SengledWifiMQTT:
             topic (str): topic to subscribe to
             callback -- callback to call when a message comes in
         Returns:
-            bool
+            bool. The call returns right away, the messages are delivered while the event loop runs, \
+                or by paho's network thread when called without the event loop running.
         """
-        if not self.mqtt_client.is_connected():
-            _LOGGER.debug("SengledWifiApi: MQTT Subscribe - not connected, trying to connect and subscribe")
-            self.sync_connect()
+        # without the event loop running _ensure_connected starts paho's network thread once, even if connected
+        if not self._ensure_connected():
+            _LOGGER.debug("SengledWifiApi: MQTT Subscribe - not connected, connecting, not subscribed")
+            return False
 
         r = self.mqtt_client.subscribe(topic)
 
@@ -270,6 +538,6 @@ class SengledWifiMQTT:
         if r[0] != mqtt.MQTT_ERR_SUCCESS:
             return False
 
+        # the messages are read by the event loop or paho's network thread, loop_forever() would block the caller
         self.mqtt_client.message_callback_add(topic, callback)
-        self.mqtt_client.loop_forever()
         return True